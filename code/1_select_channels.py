@@ -1,12 +1,12 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import imagej
-from scyjava import jimport
 from validate_folders import validate_input_file
 
 # Increase memory limit for JVM
@@ -17,6 +17,16 @@ os.environ['_JAVA_OPTIONS'] = (
     "--add-opens=java.base/java.lang=ALL-UNNAMED "
 )
 
+# Number of processed files between explicit JVM garbage collections
+GC_INTERVAL = 16
+
+# Java classes, resolved once by setup_java() after ImageJ is initialized
+IJ = None
+ZProjector = None
+Duplicator = None
+ChannelSplitter = None
+Interpreter = None
+
 
 class ImageJInitializationError(Exception):
     """
@@ -32,6 +42,10 @@ def initialize_imagej():
     Returns:
         ij (imagej.ImageJ): The initialized ImageJ instance.
     """
+    # Imported here so that argument parsing and folder validation
+    # do not pay for the JVM/Maven machinery
+    import imagej
+
     # Attempt to initialize ImageJ headless mode
     print("Initializing ImageJ...")
     try:
@@ -40,9 +54,70 @@ def initialize_imagej():
         raise ImageJInitializationError(
             f"Failed to initialize ImageJ: {e}")
     print(f"ImageJ initialization completed. Version: {ij.getVersion()}")
+
+    # Bio-Formats reads through a 1 MiB NIO buffer by default; a small
+    # buffer opens images considerably faster, especially on network storage
+    try:
+        from scyjava import jimport
+        jimport('loci.common.NIOFileHandle').setDefaultBufferSize(8192)
+    except Exception as e:
+        logging.warning(f"Could not set Bio-Formats buffer size: {e}")
     return ij
 
 
+def setup_java() -> None:
+    """
+    Resolves the Java classes used by this script and stores
+    them at module level, so they are looked up only once.
+    """
+    global IJ, ZProjector, Duplicator, ChannelSplitter, Interpreter
+    from scyjava import jimport
+    IJ = jimport('ij.IJ')
+    ZProjector = jimport('ij.plugin.ZProjector')
+    Duplicator = jimport('ij.plugin.Duplicator')
+    ChannelSplitter = jimport('ij.plugin.ChannelSplitter')
+    Interpreter = jimport('ij.macro.Interpreter')
+
+
+def project_channel(imp, channel: int, method: int):
+    """
+    Projects all slices of one channel of a Z-stack.
+
+    Args:
+        imp: multi-channel Z-stack ImagePlus.
+        channel: channel to project (starting from 1).
+        method: ZProjector method, e.g. ZProjector.MAX_METHOD.
+
+    Returns:
+        ImagePlus with the projection.
+    """
+    # All slices and frames of the channel
+    imp_channel = Duplicator().run(imp,
+                                   channel, channel,
+                                   1, imp.getNSlices(),
+                                   1, imp.getNFrames())
+    zp = ZProjector(imp_channel)
+    zp.setMethod(method)
+    zp.doProjection()
+    imp_channel.close()
+    return zp.getProjection()
+
+
+def save_projection(imp, output_path: str) -> None:
+    """
+    Resizes a 2D image to 1024x1024, converts it to 8-bit
+    and saves it as TIFF.
+
+    Args:
+        imp: 2D ImagePlus; it is left open.
+        output_path: path of the TIFF file to write.
+    """
+    imp_resized = imp.resize(1024, 1024, 1, "bilinear")
+    IJ.run(imp_resized, "8-bit", "")
+    IJ.saveAsTiff(imp_resized, output_path)
+    imp_resized.close()
+
+
 def validate_folders(input_json_path: str) -> list:
     folder_paths = validate_input_file(input_json_path)
     valid_folders = []
@@ -97,9 +172,7 @@ def process_image(valid_folders: list) -> None:
     ij = initialize_imagej()
 
     # Import Java classes
-    IJ = jimport('ij.IJ')
-    ZProjector = jimport('ij.plugin.ZProjector')
-    ChannelSplitter = jimport('ij.plugin.ChannelSplitter')
+    setup_java()
 
     # Request file type
     print("\nSelect input file type:")
@@ -137,6 +210,7 @@ def process_image(valid_folders: list) -> None:
         foci_channels.append(channel)
 
     # Process images in each folder
+    processed_count = 0
     for input_folder in valid_folders:
         # Create a new folder 'foci_assay' for processed images
         processed_folder = os.path.join(input_folder,
@@ -161,216 +235,220 @@ def process_image(valid_folders: list) -> None:
         logging.getLogger('').addHandler(file_handler)
 
         # Create subfolder for Nuclei
-        nuclei_folder = os.path.join(processed_folder, "Nuclei")
-        Path(nuclei_folder).mkdir(parents=True, exist_ok=True)
+        nuclei_folder = Path(processed_folder) / "Nuclei"
+        nuclei_folder.mkdir(parents=True, exist_ok=True)
         print(f"Subfolder 'Nuclei' created in {processed_folder}")
 
         # Create subfolders for each Foci channel
         foci_folders = {}
         for i, channel in enumerate(foci_channels):
-            folder_name = os.path.join(processed_folder,
-                                       "Foci",
-                                       f"Foci_{i + 1}_Channel_{channel}")
-            Path(folder_name).mkdir(parents=True, exist_ok=True)
+            folder_name = (Path(processed_folder) / "Foci"
+                           / f"Foci_{i + 1}_Channel_{channel}")
+            folder_name.mkdir(parents=True, exist_ok=True)
             foci_folders[channel] = folder_name
             print(f"Subfolder "
                   f"'Foci_{i + 1}_Channel_{channel}' "
                   f"created in {processed_folder}")
 
-        # Create or open the metadata file in append mode
+        # Create the metadata file; entries are block-buffered and
+        # reach the disk when the buffer fills or the file is closed
         metadata_file_path = os.path.join(processed_folder,
                                           'image_metadata.txt')
         metadata_file = open(metadata_file_path,
                              mode='w',
-                             encoding='utf-8')
+                             encoding='utf-8',
+                             buffering=1 << 16)
         metadata_file.write("Image Metadata:\n")
         metadata_file.write("================\n")
 
+        # The same calibration is also saved as image_metadata.json,
+        # which the later steps load without parsing the text file
+        image_metadata = {}
+
         # Part 1: Image processing
         print("\nStarting Part 1: Image processing...")
 
         # Valid file extensions
         valid_exts = ('.nd2', '.tif', '.tiff')
 
+        file_paths = []
         for filename in os.listdir(input_folder):
             # Skip hidden files and macOS temporary files
             if filename.startswith('.') or filename.startswith('._'):
                 continue
 
             # Check file extension
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext not in valid_exts:
-                continue
-
-            file_path = os.path.join(input_folder, filename)
-            print(f"\nProcessing file: {file_path}")
-
-            # Close any images left open
-            IJ.run("Close All")
-
-            # Open the image
-            imp = IJ.openImage(file_path)
-            if imp is None:
-                logging.warning(f"Failed to open image: {file_path}. "
-                                f"Check Bio-Formats or file integrity.")
+            if os.path.splitext(filename)[1].lower() not in valid_exts:
                 continue
+            file_paths.append(os.path.join(input_folder, filename))
+
+        # While one image is processed, the next one is already
+        # being read by a background thread
+        opener = ThreadPoolExecutor(max_workers=1)
+        if file_paths:
+            next_imp = opener.submit(IJ.openImage, file_paths[0])
+
+        # Duplicates and projections are not displayed in batch mode,
+        # which spares ImageJ all window bookkeeping
+        Interpreter.batchMode = True
+        try:
+            for i, file_path in enumerate(file_paths):
+                filename = os.path.basename(file_path)
+                base_name, file_ext = os.path.splitext(filename)
+                file_ext = file_ext.lower()
+                print(f"\nProcessing file: {file_path}")
+
+                # Take the opened image and start reading the next one
+                current_imp = next_imp
+                if i + 1 < len(file_paths):
+                    next_imp = opener.submit(IJ.openImage, file_paths[i + 1])
+                try:
+                    imp = current_imp.result()
+                except Exception as e:
+                    logging.error(f"Error opening image {file_path}: {e}")
+                    continue
+                if imp is None:
+                    logging.warning(f"Failed to open image: {file_path}. "
+                                    f"Check Bio-Formats or file integrity.")
+                    continue
 
-            # Gather dimension info
-            width, height, channels, slices, frames = imp.getDimensions()
-            print(f"Image dimensions for '{filename}': "
-                  f"W={width}, "
-                  f"H={height}, "
-                  f"C={channels}, "
-                  f"Z={slices}, "
-                  f"T={frames}")
-
-            # ---------------------------------------------------
-            # WRITE METADATA TO THE TEXT FILE
-            # ---------------------------------------------------
-            # Retrieve calibration info
-            cal = imp.getCalibration()
-            pixel_width = cal.pixelWidth
-            pixel_height = cal.pixelHeight
-            pixel_depth = cal.pixelDepth if hasattr(cal, 'pixelDepth') else 0
-            unit = cal.getUnit()  # e.g. "micron"
-
-            # Write an entry for this image to the metadata file
-            metadata_file.write(f"Image Name: {filename}\n")
-            metadata_file.write(f"  Pixel Width: {pixel_width}\n")
-            metadata_file.write(f"  Pixel Height: {pixel_height}\n")
-            metadata_file.write(f"  Pixel Depth: {pixel_depth}\n")
-            metadata_file.write(f"  Unit: {unit}\n")
-            metadata_file.write(f"  Channels: {channels}\n")
-            metadata_file.write(f"  Slices: {slices}\n")
-            metadata_file.write(f"  Frames: {frames}\n\n")
-            metadata_file.flush()  # Ensure immediate write
-
-            # For ND2 files or Z-stack TIFFs (file types 1 and 2)
-            if (file_ext == '.nd2' or (file_ext in ('.tif', '.tiff')
-                                       and file_type in (1, 2))):
-                # Check if channels exist
-                if (nuclei_channel > channels
-                        or any(foci_channel > channels
-                               for foci_channel in foci_channels)):
-                    logging.error(f"Specified channels "
-                                  f"exceed available ({channels}) "
-                                  f"in '{filename}'.")
+                # Gather dimension info
+                width, height, channels, slices, frames = imp.getDimensions()
+                print(f"Image dimensions for '{filename}': "
+                      f"W={width}, "
+                      f"H={height}, "
+                      f"C={channels}, "
+                      f"Z={slices}, "
+                      f"T={frames}")
+
+                # ---------------------------------------------------
+                # WRITE METADATA TO THE TEXT FILE
+                # ---------------------------------------------------
+                # Retrieve calibration info
+                cal = imp.getCalibration()
+                pixel_width = cal.pixelWidth
+                pixel_height = cal.pixelHeight
+                pixel_depth = (cal.pixelDepth if hasattr(cal, 'pixelDepth')
+                               else 0)
+                unit = cal.getUnit()  # e.g. "micron"
+
+                # Write an entry for this image to the metadata file
+                metadata_file.write(f"Image Name: {filename}\n"
+                                    f"  Pixel Width: {pixel_width}\n"
+                                    f"  Pixel Height: {pixel_height}\n"
+                                    f"  Pixel Depth: {pixel_depth}\n"
+                                    f"  Unit: {unit}\n"
+                                    f"  Channels: {channels}\n"
+                                    f"  Slices: {slices}\n"
+                                    f"  Frames: {frames}\n\n")
+                image_metadata[base_name] = {
+                    'pixel_width': float(pixel_width),
+                    'pixel_height': float(pixel_height),
+                    'pixel_depth': float(pixel_depth),
+                    'unit': str(unit),
+                    'channels': int(channels),
+                    'slices': int(slices),
+                    'frames': int(frames),
+                }
+
+                # For ND2 files or Z-stack TIFFs (file types 1 and 2)
+                if (file_ext == '.nd2' or (file_ext in ('.tif', '.tiff')
+                                           and file_type in (1, 2))):
+                    # Check if channels exist
+                    if (nuclei_channel > channels
+                            or any(foci_channel > channels
+                                   for foci_channel in foci_channels)):
+                        logging.error(f"Specified channels "
+                                      f"exceed available ({channels}) "
+                                      f"in '{filename}'.")
+                        imp.close()
+                        continue
+
+                    # ----- Process NUCLEI: Max Z-projection -----
+                    print(f"Processing nuclei channel "
+                          f"{nuclei_channel} as Max Z-projection.")
+                    nuclei_proj = project_channel(imp, nuclei_channel,
+                                                  ZProjector.MAX_METHOD)
+                    nuclei_out = str(nuclei_folder
+                                     / f"{base_name}_nuclei_projection.tif")
+                    save_projection(nuclei_proj, nuclei_out)
+                    nuclei_proj.close()
+                    print(f"Nuclei (Max Z) saved to '{nuclei_out}'")
+
+                    # Process FOCI: SD Z-projection for each channel
+                    for foci_channel in foci_channels:
+                        print(f"Processing foci channel "
+                              f"{foci_channel} as SD Z-projection.")
+                        foci_proj = project_channel(imp, foci_channel,
+                                                    ZProjector.SD_METHOD)
+
+                        # Save to the corresponding Foci folder
+                        foci_out = str(foci_folders[foci_channel]
+                                       / f"{base_name}_foci_projection.tif")
+                        save_projection(foci_proj, foci_out)
+                        foci_proj.close()
+                        print(f"Foci (SD Z) saved to '{foci_out}'")
+
+                    # Close the original
                     imp.close()
-                    continue
 
-                # ----- Process NUCLEI: Max Z-projection -----
-                print(f"Processing nuclei channel "
-                      f"{nuclei_channel} as Max Z-projection.")
-                imp.setC(nuclei_channel)
-                IJ.run(imp, "Duplicate...",
-                       f"title=imp_nuclei duplicate channels={nuclei_channel}")
-                imp_nuclei = IJ.getImage()
-
-                zp_nuclei = ZProjector(imp_nuclei)
-                zp_nuclei.setMethod(ZProjector.MAX_METHOD)
-                zp_nuclei.doProjection()
-                nuclei_proj = zp_nuclei.getProjection()
-
-                # Resize & convert to 8-bit
-                nuclei_proj = nuclei_proj.resize(1024, 1024, 1, "bilinear")
-                IJ.run(nuclei_proj, "8-bit", "")
-
-                # Save
-                base_name = os.path.splitext(filename)[0]
-                nuclei_out = os.path.join(nuclei_folder,
-                                          f"{base_name}_nuclei_projection.tif")
-                IJ.saveAs(nuclei_proj, "Tiff", nuclei_out)
-                print(f"Nuclei (Max Z) saved to '{nuclei_out}'")
-
-                nuclei_proj.close()
-                imp_nuclei.close()
-
-                # Process FOCI: SD Z-projection for each channel
-                for foci_channel in foci_channels:
-                    print(f"Processing foci channel "
-                          f"{foci_channel} as SD Z-projection.")
-                    imp.setC(foci_channel)
-                    IJ.run(imp, "Duplicate...",
-                           f"title=imp_foci duplicate channels={foci_channel}")
-                    imp_foci = IJ.getImage()
-
-                    zp_foci = ZProjector(imp_foci)
-                    zp_foci.setMethod(ZProjector.SD_METHOD)
-                    zp_foci.doProjection()
-                    foci_proj = zp_foci.getProjection()
-
-                    # Resize & convert
-                    foci_proj = foci_proj.resize(1024, 1024, 1, "bilinear")
-                    IJ.run(foci_proj, "8-bit", "")
-
-                    # Save to the corresponding Foci folder
-                    foci_out = os.path.join(foci_folders[foci_channel],
-                                            f"{base_name}_foci_projection.tif")
-                    IJ.saveAs(foci_proj, "Tiff", foci_out)
-                    print(f"Foci (SD Z) saved to '{foci_out}'")
-
-                    foci_proj.close()
-                    imp_foci.close()
-
-                # Close the original
-                imp.close()
-
-            else:
-                # For 2D multi-channel TIFF files (file type 3)
-                print("Processing as 2D multi-channel TIFF file.")
-
-                # Split channels
-                splitted_channels = ChannelSplitter.split(imp)
-                total_split_channels = len(splitted_channels)
-                print(f"Total channels in TIFF: {total_split_channels}")
-
-                # Check channel availability
-                if (nuclei_channel > total_split_channels
-                        or any(foci_channel > total_split_channels
-                               for foci_channel in foci_channels)):
-                    logging.error(f"Requested channels "
-                                  f"exceed total split channels "
-                                  f"({total_split_channels}). Skipping.")
+                else:
+                    # For 2D multi-channel TIFF files (file type 3)
+                    print("Processing as 2D multi-channel TIFF file.")
+
+                    # Split channels
+                    splitted_channels = ChannelSplitter.split(imp)
+                    total_split_channels = len(splitted_channels)
+                    print(f"Total channels in TIFF: {total_split_channels}")
+
+                    # Check channel availability
+                    if (nuclei_channel > total_split_channels
+                            or any(foci_channel > total_split_channels
+                                   for foci_channel in foci_channels)):
+                        logging.error(f"Requested channels "
+                                      f"exceed total split channels "
+                                      f"({total_split_channels}). Skipping.")
+                        imp.close()
+                        continue
+
+                    # ----- Process NUCLEI (2D TIFF) -----
+                    print(f"Extracting nuclei channel "
+                          f"{nuclei_channel} from 2D TIFF.")
+                    nuclei_out = str(nuclei_folder
+                                     / f"{base_name}_nuclei_projection.tif")
+                    save_projection(splitted_channels[nuclei_channel - 1],
+                                    nuclei_out)
+                    print(f"Nuclei channel saved to '{nuclei_out}'.")
+
+                    # ----- Process FOCI (2D TIFF) -----
+                    for foci_channel in foci_channels:
+                        print(f"Extracting foci channel "
+                              f"{foci_channel} from 2D TIFF.")
+                        # Save to the corresponding Foci folder
+                        foci_out = str(foci_folders[foci_channel]
+                                       / f"{base_name}_foci_projection.tif")
+                        save_projection(splitted_channels[foci_channel - 1],
+                                        foci_out)
+                        print(f"Foci channel saved to '{foci_out}'.")
+
+                    # Close the original image
                     imp.close()
-                    continue
 
-                # ----- Process NUCLEI (2D TIFF) -----
-                print(f"Extracting nuclei channel "
-                      f"{nuclei_channel} from 2D TIFF.")
-                imp_nuclei = splitted_channels[nuclei_channel - 1]
-                imp_nuclei = imp_nuclei.resize(1024, 1024, 1, "bilinear")
-                IJ.run(imp_nuclei, "8-bit", "")
-
-                base_name = os.path.splitext(filename)[0]
-                nuclei_out = os.path.join(nuclei_folder,
-                                          f"{base_name}_nuclei_projection.tif")
-                IJ.saveAs(imp_nuclei, "Tiff", nuclei_out)
-                print(f"Nuclei channel saved to '{nuclei_out}'.")
-                imp_nuclei.close()
-
-                # ----- Process FOCI (2D TIFF) -----
-                for foci_channel in foci_channels:
-                    print(f"Extracting foci channel "
-                          f"{foci_channel} from 2D TIFF.")
-                    imp_foci = splitted_channels[foci_channel - 1]
-                    imp_foci = imp_foci.resize(1024, 1024, 1, "bilinear")
-                    IJ.run(imp_foci, "8-bit", "")
-
-                    # Save to the corresponding Foci folder
-                    foci_out = os.path.join(foci_folders[foci_channel],
-                                            f"{base_name}_foci_projection.tif")
-                    IJ.saveAs(imp_foci, "Tiff", foci_out)
-                    print(f"Foci channel saved to '{foci_out}'.")
-                    imp_foci.close()
-
-                # Close the original image
-                imp.close()
-
-            # Close all images to free memory
-            IJ.run("Close All")
+                # Reclaim the pixel arrays of closed images regularly so
+                # long runs do not build up heap pressure
+                processed_count += 1
+                if processed_count % GC_INTERVAL == 0:
+                    IJ.run("Collect Garbage", "")
+        finally:
+            opener.shutdown()
+            Interpreter.batchMode = False
 
         # Close the metadata file after all files in this folder are processed
         metadata_file.close()
+        with open(os.path.join(processed_folder, 'image_metadata.json'),
+                  mode='w',
+                  encoding='utf-8') as f:
+            json.dump(image_metadata, f, indent=2)
 
 
 def select_channel_name(input_json_path: str) -> None:
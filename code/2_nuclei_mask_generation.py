@@ -2,18 +2,31 @@
 
 import argparse
 import logging
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 
-import imagej
 import numpy as np
-from csbdeep.utils import normalize
-from scyjava import jimport
-from skimage.io import imread, imsave
-from stardist.models import StarDist2D
+import tifffile
+from skimage.io import imread
 from validate_folders import validate_input_file
 
+# Number of processed files between explicit JVM garbage collections
+GC_INTERVAL = 16
+
+# Default number of ImageJ worker processes; every worker runs a full
+# Fiji JVM with its own default heap, so this is kept small
+DEFAULT_NJOBS = 2
+
+# Java classes, resolved once by setup_java() after ImageJ is initialized
+IJ = None
+Interpreter = None
+Opener = None
+ParticleAnalyzer = None
+ResultsTable = None
+
 
 class ImageJInitializationError(Exception):
     """
@@ -29,6 +42,10 @@ def initialize_imagej():
     Returns:
         ij (imagej.ImageJ): The initialized ImageJ instance.
     """
+    # Imported here so that argument parsing and folder validation
+    # do not pay for the JVM/Maven machinery
+    import imagej
+
     # Attempt to initialize ImageJ headless mode
     print("Initializing ImageJ...")
     try:
@@ -37,9 +54,31 @@ def initialize_imagej():
         raise ImageJInitializationError(
             f"Failed to initialize ImageJ: {e}")
     print(f"ImageJ initialization completed. Version: {ij.getVersion()}")
+
+    # Bio-Formats reads through a 1 MiB NIO buffer by default; a small
+    # buffer opens images considerably faster, especially on network storage
+    try:
+        from scyjava import jimport
+        jimport('loci.common.NIOFileHandle').setDefaultBufferSize(8192)
+    except Exception as e:
+        logging.warning(f"Could not set Bio-Formats buffer size: {e}")
     return ij
 
 
+def setup_java() -> None:
+    """
+    Resolves the Java classes used by this script and stores
+    them at module level, so they are looked up only once.
+    """
+    global IJ, Interpreter, Opener, ParticleAnalyzer, ResultsTable
+    from scyjava import jimport
+    IJ = jimport('ij.IJ')
+    Interpreter = jimport('ij.macro.Interpreter')
+    Opener = jimport('ij.io.Opener')
+    ParticleAnalyzer = jimport('ij.plugin.filter.ParticleAnalyzer')
+    ResultsTable = jimport('ij.measure.ResultsTable')
+
+
 def validate_folders(input_json_path: str) -> list:
     valid_folders = validate_input_file(input_json_path)
     nuclei_folders = []
@@ -83,6 +122,11 @@ def find_nuclei(nuclei_folders: list) -> list:
     Returns:
         List of paths to folders with processed masks.
     """
+    # Imported here so that the ImageJ worker processes, which
+    # re-import this module, do not load TensorFlow
+    from csbdeep.utils import normalize
+    from stardist.models import StarDist2D
+
     # Load pre-trained Versatile (fluorescent nuclei) model
     model = StarDist2D.from_pretrained('2D_versatile_fluo')
 
@@ -111,8 +155,10 @@ def find_nuclei(nuclei_folders: list) -> list:
         logging.getLogger('').addHandler(file_handler)
 
         # Get list of files with .tif extension
-        image_files = [f for f in os.listdir(nuclei_folder)
-                       if f.endswith('.tif')]
+        with os.scandir(nuclei_folder) as it:
+            image_files = [entry.name for entry in it
+                           if entry.is_file()
+                           and entry.name.endswith('.tif')]
 
         # Check if there are any images in the folder
         if not image_files:
@@ -144,64 +190,99 @@ def find_nuclei(nuclei_folders: list) -> list:
             base_name, ext = os.path.splitext(image_file)
             new_file_name = f"{base_name}_StarDist_processed{ext}"
             output_path = os.path.join(output_folder, new_file_name)
-            imsave(output_path, labels.astype(np.uint16))
+            # Label images are mostly background; a fast deflate level
+            # shrinks them considerably at little CPU cost
+            tifffile.imwrite(output_path, labels.astype(np.uint16),
+                             compression='zlib',
+                             compressionargs={'level': 1})
 
         print(f"Image processing completed in folder '{nuclei_folder}'.")
 
     return processed_folders
 
 
-def process_nuclei(valid_folders: list,
-                   particle_size: int) -> None:
+def analyze_particles(imp, particle_size: int):
     """
-    Process all files from the provided directories (.tif)
-    for the Nuclei channel using ImageJ.
+    Runs ImageJ's ParticleAnalyzer on a binary image.
 
     Args:
-        valid_folders: list of folders containing 2D images.
-        particle_size: minimum size of nuclei to analyze.
+        imp: binary ImagePlus to analyze.
+        particle_size: minimum size of particles to keep (in pixels).
+
+    Returns:
+        ImagePlus with the mask of the kept particles,
+        or None if the analysis failed.
     """
-    # Initialize ImageJ
-    ij = initialize_imagej()
+    pa = ParticleAnalyzer(ParticleAnalyzer.SHOW_MASKS, 0, ResultsTable(),
+                          particle_size, float('inf'))
+    pa.setHideOutputImage(True)
+    if not pa.analyze(imp):
+        return None
+    return pa.getOutputImage()
 
-    # Import Java classes
-    IJ = jimport('ij.IJ')
-    WindowManager = jimport('ij.WindowManager')
 
-    # Process images in each folder
-    for input_folder in valid_folders:
-        # Generate timestamp for the folder name
-        current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
+def mask_to_array(imp) -> np.ndarray:
+    """
+    Copies the pixels of an 8-bit ImagePlus into a NumPy array.
 
-        # Create a new folder 'Final_Nuclei_Mask_<timestamp>'
-        # in the same directory as input_folder
-        processed_folder = os.path.join(os.path.dirname(input_folder),
-                                        f'Final_Nuclei_Mask_'
-                                        f'{current_datetime}')
+    Args:
+        imp: 8-bit ImagePlus.
 
-        if os.path.exists(processed_folder):
-            response = input(
-                f"The folder {processed_folder} already exists. "
-                "Do you want to overwrite existing results? (yes/no): "
-            ).strip().lower()
-            if response == 'no':
-                raise ValueError("Analysis canceled by user.")
-        Path(processed_folder).mkdir(parents=True, exist_ok=True)
-        print(f"\nProcessed images will be saved in: {processed_folder}")
+    Returns:
+        uint8 array of shape (height, width).
+    """
+    # Java bytes are signed; the buffer is reinterpreted, not converted
+    pixels = np.asarray(imp.getProcessor().getPixels())
+    return pixels.view(np.uint8).reshape(imp.getHeight(), imp.getWidth())
 
-        # Set up logging
-        log_file = os.path.join(processed_folder, 'nuclei_log.txt')
-        file_handler = logging.FileHandler(log_file, mode='w')
-        file_handler.setLevel(logging.WARNING)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s - '
-                                                    '%(levelname)s - '
-                                                    '%(message)s'))
-        logging.getLogger('').addHandler(file_handler)
 
-        # Valid file extensions
-        valid_exts = ('.tif', '.tiff')
+def init_worker() -> None:
+    """
+    Initializes ImageJ and the Java classes once per worker process;
+    they are then reused for every folder the worker processes.
+    """
+    initialize_imagej()
+    setup_java()
+
 
-        for filename in os.listdir(input_folder):
+def process_nuclei_folder(input_folder: str,
+                          processed_folder: str,
+                          particle_size: int) -> None:
+    """
+    Processes the StarDist masks of one folder with ImageJ
+    and saves the final masks into processed_folder.
+
+    Args:
+        input_folder: folder containing 2D images.
+        processed_folder: folder for the final masks.
+        particle_size: minimum size of nuclei to analyze.
+    """
+    # Set up logging
+    log_file = os.path.join(processed_folder, 'nuclei_log.txt')
+    file_handler = logging.FileHandler(log_file, mode='w')
+    file_handler.setLevel(logging.WARNING)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - '
+                                                '%(levelname)s - '
+                                                '%(message)s'))
+    logging.getLogger('').addHandler(file_handler)
+
+    # Valid file extensions
+    valid_exts = ('.tif', '.tiff')
+
+    # One opener is reused for all images of the folder
+    opener = Opener()
+    opener.setSilentMode(True)
+
+    with os.scandir(input_folder) as it:
+        entries = [entry for entry in it if entry.is_file()]
+
+    # Batch mode keeps intermediate images out of the window list;
+    # it is switched off again even if processing fails
+    Interpreter.batchMode = True
+    try:
+        processed_count = 0
+        for entry in entries:
+            filename = entry.name
             # Skip hidden files and files starting with "._"
             if filename.startswith('.') or filename.startswith('._'):
                 logging.warning(f"Skipping hidden "
@@ -216,59 +297,145 @@ def process_nuclei(valid_folders: list,
                 logging.error(f"Skipping '{filename}' (unsupported format).")
                 continue
 
-            file_path = os.path.join(input_folder, filename)
+            file_path = entry.path
             print(f"\nProcessing file: {file_path}")
 
-            # Close any images left open
-            IJ.run("Close All")
-
             # Open the image
-            imp = IJ.openImage(file_path)
+            imp = opener.openImage(file_path)
             if imp is None:
                 logging.warning(f"Failed to open image: "
                                 f"{file_path}. "
                                 f"Check Bio-Formats or file integrity.")
                 continue
 
-            # Convert image to 8-bit
-            IJ.run(imp, "8-bit", "")
-
-            # Threshold
-            IJ.setThreshold(imp, 1, 255)
-            IJ.run(imp, "Convert to Mask", "")
-            IJ.run(imp, "Watershed", "")
+            imp_mask = None
+            try:
+                # Convert image to 8-bit
+                IJ.run(imp, "8-bit", "")
 
-            # Analyze particles with specified particle size
-            IJ.run(imp, "Analyze Particles...",
-                   f"size={particle_size}-Infinity pixel show=Masks")
+                # Threshold
+                IJ.setThreshold(imp, 1, 255)
+                IJ.run(imp, "Convert to Mask", "")
+                IJ.run(imp, "Watershed", "")
 
-            # Get processed image
-            mask_title = 'Mask of ' + filename
-            imp_mask = WindowManager.getImage(mask_title)
-            if imp_mask is None:
-                imp_mask = WindowManager.getCurrentImage()
+                # Analyze particles with specified particle size
+                imp_mask = analyze_particles(imp, particle_size)
                 if imp_mask is None:
                     logging.error(f"Failed to get mask for image: {file_path}")
-                    imp.close()
                     continue
 
-            # Save processed image
-            base_name = os.path.splitext(filename)[0]
-            output_path = os.path.join(processed_folder,
-                                       f"{base_name}_processed.tif")
-            IJ.saveAs(imp_mask, "Tiff", output_path)
-            print(f"Processed image saved: {output_path}")
+                # Save processed image
+                base_name = os.path.splitext(filename)[0]
+                output_path = os.path.join(processed_folder,
+                                           f"{base_name}_processed.tif")
+                # Written with tifffile to get a compressed file; an
+                # inverting LUT is kept as a white-is-zero TIFF
+                photometric = ('miniswhite' if imp_mask.isInvertedLut()
+                               else 'minisblack')
+                tifffile.imwrite(output_path, mask_to_array(imp_mask),
+                                 photometric=photometric,
+                                 compression='zlib',
+                                 compressionargs={'level': 1})
+                print(f"Processed image saved: {output_path}")
+            finally:
+                # Close the images even if a command failed, so a worker
+                # does not carry them over to its next folder
+                imp.close()
+                if imp_mask is not None:
+                    imp_mask.close()
+
+            # Reclaim the pixel arrays of closed images regularly so
+            # long runs do not build up heap pressure
+            processed_count += 1
+            if processed_count % GC_INTERVAL == 0:
+                IJ.run("Collect Garbage", "")
+    finally:
+        Interpreter.batchMode = False
+
+    logging.getLogger('').removeHandler(file_handler)
+    file_handler.close()
+
+
+def process_nuclei(valid_folders: list,
+                   particle_size: int,
+                   njobs: int = None) -> None:
+    """
+    Process all files from the provided directories (.tif)
+    for the Nuclei channel using ImageJ. Folders are processed
+    in parallel, with one ImageJ instance per worker process.
+
+    Args:
+        valid_folders: list of folders containing 2D images.
+        particle_size: minimum size of nuclei to analyze.
+        njobs: number of worker processes (DEFAULT_NJOBS by default).
+    """
+    # Create the output folders up front, so that any question
+    # to the user is asked before the workers start
+    tasks = []
+    for input_folder in valid_folders:
+        # Skip folders without masks before any output folder
+        # is created or any JVM is started for them
+        with os.scandir(input_folder) as it:
+            has_masks = any(entry.is_file()
+                            and entry.name.lower().endswith(('.tif', '.tiff'))
+                            and not entry.name.startswith('.')
+                            for entry in it)
+        if not has_masks:
+            logging.warning(f"No TIF/TIFF files found in "
+                            f"'{input_folder}'. Skipping folder.")
+            continue
+
+        # Generate timestamp for the folder name
+        current_datetime = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-            # Close images
-            imp.close()
-            imp_mask.close()
+        # Create a new folder 'Final_Nuclei_Mask_<timestamp>'
+        # in the same directory as input_folder
+        processed_folder = os.path.join(os.path.dirname(input_folder),
+                                        f'Final_Nuclei_Mask_'
+                                        f'{current_datetime}')
 
-        # Close all images to free memory
-        IJ.run("Close All")
+        if os.path.exists(processed_folder):
+            response = input(
+                f"The folder {processed_folder} already exists. "
+                "Do you want to overwrite existing results? (yes/no): "
+            ).strip().lower()
+            if response == 'no':
+                raise ValueError("Analysis canceled by user.")
+        Path(processed_folder).mkdir(parents=True, exist_ok=True)
+        print(f"\nProcessed images will be saved in: {processed_folder}")
+        tasks.append((input_folder, processed_folder))
+
+    if not tasks:
+        print("No StarDist masks to process.")
+        return
+
+    # Every worker starts its own JVM, so only a few run by default
+    if njobs is None:
+        njobs = DEFAULT_NJOBS
+    max_workers = max(1, min(njobs, len(tasks)))
+
+    # 'spawn' keeps the JVMs of the workers fully isolated
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker) as executor:
+        futures = {
+            executor.submit(process_nuclei_folder,
+                            input_folder,
+                            processed_folder,
+                            particle_size): input_folder
+            for input_folder, processed_folder in tasks
+        }
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                logging.error(f"Failed to process folder "
+                              f"'{futures[fut]}': {e}")
 
 
 def main(input_json_path: str,
-         particle_size: int) -> None:
+         particle_size: int,
+         njobs: int = None) -> None:
     """
     Main function to analyze and process nuclei.
     """
@@ -280,7 +447,7 @@ def main(input_json_path: str,
 
     # Step 2: Process nuclei using ImageJ
     print("Starting Step 2: Processing nuclei with ImageJ...")
-    process_nuclei(processed_folders, particle_size)
+    process_nuclei(processed_folders, particle_size, njobs)
     print("Step 2 completed: Nuclei processing finished.")
 
 
@@ -297,5 +464,12 @@ if __name__ == '__main__':
                         help="Minimum size of nuclei to analyze (in pixels). "
                              "Default is 2500",
                         default=2500)
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        help="Number of folders processed in parallel, "
+                             "each with its own ImageJ. "
+                             "Default is 2",
+                        default=None)
     args = parser.parse_args()
-    main(args.input, args.particle_size)
+    main(args.input, args.particle_size, args.jobs)
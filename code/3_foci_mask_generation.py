@@ -1,39 +1,19 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
-import imagej
-from scyjava import jimport
+import numpy as np
+import scipy.ndimage as ndi
+import tifffile
+from skimage.morphology import h_maxima
+from skimage.segmentation import watershed
 from validate_folders import validate_input_file
 
 
-class ImageJInitializationError(Exception):
-    """
-    Exception raised for unsuccessful initialization of ImageJ.
-    """
-    pass
-
-
-def initialize_imagej():
-    """
-    Initialize ImageJ in headless mode.
-
-    Returns:
-        ij (imagej.ImageJ): The initialized ImageJ instance.
-    """
-    # Attempt to initialize ImageJ headless mode
-    print("Initializing ImageJ...")
-    try:
-        ij = imagej.init('sc.fiji:fiji', mode='headless')
-    except Exception as e:
-        raise ImageJInitializationError(
-            f"Failed to initialize ImageJ: {e}")
-    print(f"ImageJ initialization completed. Version: {ij.getVersion()}")
-    return ij
-
-
 def validate_folders(input_json_path: str) -> dict:
     valid_folders = validate_input_file(input_json_path)
     # checking 'Foci' and the latest
@@ -72,25 +52,20 @@ def validate_folders(input_json_path: str) -> dict:
             result[folder]["foci_folder"] = foci_folder
 
         # Look for the latest 'Nuclei_StarDist_mask_processed_<timestamp>'
-        processed_folders = []
-        for name in os.listdir(foci_assay_folder):
-            if name.startswith('Nuclei_StarDist_mask_processed_'):
-                timestamp_str = name.replace('Nuclei_StarDist_mask_processed_',
-                                             '')
-                timestamp = datetime.strptime(timestamp_str,
-                                              '%Y%m%d_%H%M%S')
-                processed_folders.append((timestamp,
-                                          os.path.join(foci_assay_folder,
-                                                       name)))
+        processed_folders = [
+            name for name in os.listdir(foci_assay_folder)
+            if name.startswith('Nuclei_StarDist_mask_processed_')
+        ]
 
         if len(processed_folders) == 0:
             logging.error(f"No folders found "
                           f"starting with 'Nuclei_StarDist_mask_processed_' "
                           f"in '{foci_assay_folder}'. Skipping.")
         else:
-            # Select the latest folder
-            latest_processed_folder = max(processed_folders,
-                                          key=lambda x: x[0])[1]
+            # Select the latest folder; YYYYMMDD_HHMMSS timestamps
+            # sort lexicographically in chronological order
+            latest_processed_folder = os.path.join(foci_assay_folder,
+                                                   max(processed_folders))
             print(f"Found the latest folder "
                   f"'Nuclei_StarDist_mask_processed_': "
                   f"{latest_processed_folder}")
@@ -135,12 +110,30 @@ def validate_folders(input_json_path: str) -> dict:
     return result
 
 
+# Watershed settings of segment_foci; part of the rerun fingerprint
+# so masks made with other settings are not reused
+SEGMENTATION_PARAMS = {'h_maxima': 0.5, 'connectivity': 2}
+
+# Calibration fields of image_metadata.txt: (dictionary key, converter)
+METADATA_FIELDS = {
+    'Pixel Width': ('pixel_width', float),
+    'Pixel Height': ('pixel_height', float),
+    'Pixel Depth': ('pixel_depth', float),
+    'Unit': ('unit', str),
+}
+
+
 def parse_metadata_file(metadata_path: str) -> dict:
     """
     Reads 'image_metadata.txt' and returns a dictionary
     keyed by the base image name (e.g., "image_1") with
-    a dictionary of calibration info.
+    a dictionary of calibration info. The 'image_metadata.json'
+    written next to it by step 1 is loaded instead when present.
     """
+    json_path = os.path.splitext(metadata_path)[0] + '.json'
+    if os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
     if not os.path.exists(metadata_path):
         logging.warning(f"Metadata file not found: {metadata_path}")
         return {}
@@ -151,8 +144,10 @@ def parse_metadata_file(metadata_path: str) -> dict:
 
     with open(metadata_path, 'r', encoding='utf-8') as f:
         for line in f:
-            line = line.strip()
-            if line.startswith("Image Name:"):
+            # Every line is "<field>: <value>"
+            field, _, val = line.partition(':')
+            field = field.strip()
+            if field == "Image Name":
                 # If we have a previous entry, store
                 # it before starting a new one
                 if current_name and current_data:
@@ -160,20 +155,11 @@ def parse_metadata_file(metadata_path: str) -> dict:
                     metadata_dict[base_key] = current_data
 
                 # Start a new entry
-                current_name = line.replace("Image Name:", "").strip()
+                current_name = val.strip()
                 current_data = {}
-            elif line.startswith("Pixel Width:"):
-                val = line.replace("Pixel Width:", "").strip()
-                current_data['pixel_width'] = float(val)
-            elif line.startswith("Pixel Height:"):
-                val = line.replace("Pixel Height:", "").strip()
-                current_data['pixel_height'] = float(val)
-            elif line.startswith("Pixel Depth:"):
-                val = line.replace("Pixel Depth:", "").strip()
-                current_data['pixel_depth'] = float(val)
-            elif line.startswith("Unit:"):
-                val = line.replace("Unit:", "").strip()
-                current_data['unit'] = val
+            elif field in METADATA_FIELDS:
+                key, convert = METADATA_FIELDS[field]
+                current_data[key] = convert(val.strip())
 
         # Store the last entry if present
         if current_name and current_data:
@@ -186,17 +172,143 @@ def parse_metadata_file(metadata_path: str) -> dict:
 def find_metadata_for_file(filename: str, metadata_dict: dict) -> dict:
     """
     Attempt to find the calibration data in 'metadata_dict'
-    for a given filename (e.g. 'image_1_nuclei_projection.tif').
+    for a given filename (e.g. 'image_1_foci_projection.tif').
+    The image name is looked up directly; a substring search is
+    only used for files that do not follow the naming scheme.
     """
+    stem = os.path.splitext(filename)[0]
+    for suffix in ('_foci_projection', '_nuclei_projection'):
+        stem = stem.removesuffix(suffix)
+    cal_data = metadata_dict.get(stem)
+    if cal_data is not None:
+        return cal_data
+
     for base_key, cal_data in metadata_dict.items():
         if base_key in filename:
             return cal_data
     return None
 
 
+def read_image(path: str) -> np.ndarray:
+    """
+    Reads a single-page TIFF. Uncompressed images, such as the
+    projections written by step 1, are memory-mapped instead of
+    being copied into memory.
+    """
+    try:
+        return tifffile.memmap(path, mode='r')
+    except ValueError:
+        # Compressed or tiled data cannot be mapped
+        return tifffile.imread(path)
+
+
+def to_8bit(image: np.ndarray) -> np.ndarray:
+    """
+    Converts an image to 8-bit the way ImageJ's "8-bit" command
+    does, by scaling its min-max range to 0-255 and rounding
+    to the nearest grey level.
+    """
+    if image.dtype == np.uint8:
+        return image
+    min_val = float(image.min())
+    max_val = float(image.max())
+    scale = 256.0 / (max_val - min_val + 1)
+    # ImageJ's TypeConverter rounds with (int)(v * scale + 0.5)
+    return np.clip((image - min_val) * scale + 0.5,
+                   0, 255).astype(np.uint8)
+
+
+def otsu_threshold(image: np.ndarray) -> int:
+    """
+    Computes Otsu's threshold of an 8-bit image. The between-class
+    variance of all 256 candidate thresholds is evaluated at once
+    from the image histogram.
+
+    Returns:
+        The lowest intensity counted as foreground.
+    """
+    hist = np.bincount(image.ravel(), minlength=256).astype(np.float64)
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_b2 = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    sigma_b2[~np.isfinite(sigma_b2)] = 0.0
+    # Pixels above the optimal split belong to the foreground
+    return int(np.argmax(sigma_b2)) + 1
+
+
+def segment_foci(image: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Thresholds an 8-bit image and splits touching foci with a
+    distance-transform watershed, like ImageJ's binary Watershed.
+
+    Args:
+        image: 8-bit foci image
+        threshold: lowest intensity counted as foci
+
+    Returns:
+        8-bit mask with foci set to 255 and 1-pixel
+        background lines between touching foci.
+    """
+    mask = image >= threshold
+    dist = ndi.distance_transform_edt(mask)
+    # One marker per distance maximum that rises at least 0.5 above its
+    # surroundings, similar to the tolerance used by ImageJ
+    markers, _ = ndi.label(h_maxima(dist, SEGMENTATION_PARAMS['h_maxima']),
+                           structure=np.ones((3, 3), dtype=bool))
+    # 8-connected lines, so step 4's 8-connected labeling keeps
+    # diagonally touching foci apart
+    labels = watershed(-dist, markers, mask=mask,
+                       connectivity=SEGMENTATION_PARAMS['connectivity'],
+                       watershed_line=True)
+    return np.where(labels > 0, 255, 0).astype(np.uint8)
+
+
+def imagej_unit(unit: str) -> str:
+    """
+    Returns a calibration unit that can be written into an ImageJ
+    TIFF description, which must be ASCII. Microns are written as
+    'micron', as ImageJ's FileSaver does; other non-ASCII characters
+    are escaped.
+    """
+    if unit in ('\u00b5m', '\u03bcm'):
+        return 'micron'
+    return unit.encode('ascii', 'backslashreplace').decode('ascii')
+
+
+def get_latest_foci_mask_folder(foci_masks_base: str,
+                                chosen_subfolder: str) -> str:
+    """
+    Finds the newest '<chosen_subfolder>_<timestamp>' result folder
+    in 'Foci_Masks'. Returns None if there is none.
+    """
+    if not os.path.isdir(foci_masks_base):
+        return None
+
+    prefix = f"{chosen_subfolder}_"
+    timestamps = []
+    with os.scandir(foci_masks_base) as it:
+        names = [entry.name for entry in it if entry.is_dir()]
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        # Timestamp format is YYYYMMDD_HHMMSS; this also keeps
+        # 'Foci_1_Channel_10_...' out of the results for 'Foci_1_Channel_1'
+        timestamp = name[len(prefix):]
+        if (len(timestamp) == 15 and timestamp[8] == '_'
+                and (timestamp[:8] + timestamp[9:]).isdigit()):
+            timestamps.append(timestamp)
+
+    if not timestamps:
+        return None
+    return os.path.join(foci_masks_base, f"{prefix}{max(timestamps)}")
+
+
 def filter_foci(folder: dict,
                 chosen_subfolder: str,
-                foci_threshold: int) -> None:
+                foci_threshold,
+                force: bool = False) -> None:
     """
     Filters machine-learning results for Foci
     images in one specific subfolder.
@@ -207,11 +319,16 @@ def filter_foci(folder: dict,
                 - 'foci_folder'
         chosen_subfolder: name of the subfolder to analyze
         (e.g. "Foci_1_Channel_1")
-        foci_threshold: threshold value for foci analysis
+        foci_threshold: threshold value for foci analysis,
+        or 'auto' for a per-image Otsu threshold
+        force: if False, the latest result folder is reused and
+        files already processed with the same threshold are skipped;
+        if True, everything is processed into a new folder
     """
     # Extract the relevant paths
     foci_folder = folder['foci_folder']
     foci_assay_folder = folder['foci_assay_folder']
+    print(f"\nAnalyzing folder '{foci_folder}'")
 
     # Build the path to the chosen subfolder
     subfolder_path = os.path.join(foci_folder, chosen_subfolder)
@@ -222,23 +339,19 @@ def filter_foci(folder: dict,
               f"not found in {foci_folder}. Skipping.\n")
         return
 
-    # Collect TIF/TIFF files within the chosen subfolder
-    foci_files = [
-        f for f in os.listdir(subfolder_path)
-        if f.lower().endswith((".tif", ".tiff"))
-    ]
+    # Collect TIF/TIFF files within the chosen subfolder; the
+    # directory entries are kept to reuse their stat results
+    with os.scandir(subfolder_path) as it:
+        foci_files = [
+            entry for entry in it
+            if entry.is_file() and entry.name.lower().endswith((".tif",
+                                                                ".tiff"))
+        ]
     if not foci_files:
         print(f"  - No TIF/TIFF files found in "
               f"{subfolder_path}. Nothing to do.\n")
         return
 
-    # Initialize ImageJ
-    ij = initialize_imagej()
-
-    # Import Java classes
-    IJ = jimport('ij.IJ')
-    WindowManager = jimport('ij.WindowManager')
-
     # Read metadata from image_metadata.txt
     metadata_path = os.path.join(foci_assay_folder,
                                  "image_metadata.txt")
@@ -248,12 +361,18 @@ def filter_foci(folder: dict,
     foci_masks_base = os.path.join(foci_assay_folder, "Foci_Masks")
     os.makedirs(foci_masks_base, exist_ok=True)
 
-    # Create a timestamped subfolder for the chosen subfolder
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    result_subfolder_name = f"{chosen_subfolder}_{timestamp}"
-    foci_mask_folder = os.path.join(foci_masks_base,
-                                    result_subfolder_name)
-    os.makedirs(foci_mask_folder, exist_ok=True)
+    # Reuse the latest result folder of the chosen subfolder, or
+    # create a new timestamped one
+    foci_mask_folder = None
+    if not force:
+        foci_mask_folder = get_latest_foci_mask_folder(foci_masks_base,
+                                                       chosen_subfolder)
+    if foci_mask_folder is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        result_subfolder_name = f"{chosen_subfolder}_{timestamp}"
+        foci_mask_folder = os.path.join(foci_masks_base,
+                                        result_subfolder_name)
+        os.makedirs(foci_mask_folder, exist_ok=True)
 
     # Setup logging to file in the result subfolder
     file_handler = logging.FileHandler(os.path.join(foci_mask_folder,
@@ -268,20 +387,30 @@ def filter_foci(folder: dict,
     print(f"  - Processing {len(foci_files)} file(s) in "
           f"'{chosen_subfolder}'...")
 
-    # Process each TIF file
-    for filename in foci_files:
-        file_path = os.path.join(subfolder_path, filename)
-        print(f"    -> {filename}")
-        IJ.run("Close All")  # Close images before starting
-
-        # Open image
-        imp = IJ.openImage(file_path)
-        if imp is None:
-            logging.error(f"Failed to open image: {file_path}")
-            continue
-
-        # Convert image to 8-bit
-        IJ.run(imp, "8-bit", "")
+    # Fingerprints (mtime, size, threshold, calibration, segmentation
+    # settings) of already processed inputs
+    cache_path = os.path.join(foci_mask_folder, '_cache.json')
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+
+    # Drop masks of inputs that no longer exist, so a reused result
+    # folder only holds masks of the current inputs
+    input_names = {entry.name for entry in foci_files}
+    with os.scandir(foci_mask_folder) as it:
+        orphans = [entry for entry in it
+                   if entry.name.startswith("processed_")
+                   and entry.name[len("processed_"):] not in input_names]
+    for entry in orphans:
+        os.remove(entry.path)
+        print(f"    -> removed {entry.name} (input no longer exists)")
+    cache = {name: fp for name, fp in cache.items() if name in input_names}
+
+    for entry in foci_files:
+        filename = entry.name
+        file_path = entry.path
+        output_path = os.path.join(foci_mask_folder, f"processed_{filename}")
 
         # Retrieve calibration info (if any) from metadata
         cal_data = find_metadata_for_file(filename, metadata_dict)
@@ -295,58 +424,68 @@ def filter_foci(folder: dict,
                             f"Using defaults.")
             pxw, pxh, pxd, unit = 0.2071602, 0.2071602, 0.5, 'micron'
 
-        # Set calibration in ImageJ
-        IJ.run(imp, "Properties...",
-               f"channels=1 slices=1 frames=1 "
-               f"pixel_width={pxw} pixel_height={pxh} voxel_depth={pxd}")
-
-        # Optionally set the units
-        calibration = imp.getCalibration()
-        calibration.setXUnit(unit)
-        calibration.setYUnit(unit)
-        calibration.setZUnit(unit)
-
-        # Threshold & convert to mask
-        IJ.setThreshold(imp, foci_threshold, 255)
-        IJ.run(imp, "Convert to Mask", "")
-        IJ.run(imp, "Watershed", "")
-
-        # Analyze particles
-        IJ.run(imp, "Analyze Particles...", "size=0-Infinity pixel show=Masks")
-
-        # Retrieve the new mask image
-        mask_title = 'Mask of ' + filename
-        imp_mask = WindowManager.getImage(mask_title)
-        if imp_mask is None:
-            imp_mask = WindowManager.getCurrentImage()
-            if imp_mask is None:
-                logging.error(f"Failed to get mask for image: {file_path}")
-                imp.close()
-                continue
-
-        # Save processed image
-        output_path = os.path.join(foci_mask_folder, f"processed_{filename}")
-        IJ.saveAs(imp_mask, "Tiff", output_path)
+        # Skip files that were processed unchanged with the same
+        # threshold, calibration and segmentation settings
+        stat = entry.stat()
+        fingerprint = {'mtime_ns': stat.st_mtime_ns,
+                       'size': stat.st_size,
+                       'threshold': foci_threshold,
+                       'calibration': [pxw, pxh, pxd, unit],
+                       'segmentation': SEGMENTATION_PARAMS}
+        if (not force and cache.get(filename) == fingerprint
+                and os.path.exists(output_path)):
+            print(f"    -> {filename} (up to date, skipped)")
+            continue
+
+        try:
+            image = to_8bit(read_image(file_path))
+        except Exception as e:
+            logging.error(f"Failed to open image: {file_path} ({e})")
+            continue
+
+        if foci_threshold == 'auto':
+            threshold = otsu_threshold(image)
+            print(f"    -> {filename}: Otsu threshold {threshold}")
+        else:
+            threshold = foci_threshold
+            print(f"    -> {filename}")
+
+        try:
+            mask = segment_foci(image, threshold)
+            # Binary masks compress very well even at the fastest level
+            tifffile.imwrite(output_path, mask, imagej=True,
+                             resolution=(1.0 / pxw, 1.0 / pxh),
+                             metadata={'spacing': pxd,
+                                       'unit': imagej_unit(unit)},
+                             compression='zlib',
+                             compressionargs={'level': 1})
+        except Exception as e:
+            logging.warning(f"Failed to save mask: {output_path} ({e})")
+            continue
+        cache[filename] = fingerprint
 
-        # Close images
-        imp.close()
-        imp_mask.close()
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2)
 
     print(f"  - Results saved to: {foci_mask_folder}\n")
 
 
-def main_filter_foci(input_json_path: str, foci_threshold: int) -> None:
+def main_filter_foci(input_json_path: str,
+                     foci_threshold: int,
+                     force: bool = False,
+                     njobs: int = None) -> None:
     """
     Main entry point: validate & process machine-learning results for Foci.
     We prompt once for a subfolder to analyze, then apply that choice to all
-    valid folders from the JSON.
+    valid folders from the JSON. Folders are processed in parallel
+    by njobs worker processes (all CPUs by default).
     """
     # Setting up logging
     logging.basicConfig(level=logging.WARNING,
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
-    if not isinstance(foci_threshold, int):
-        raise ValueError('Foci threshold must be an integer!')
+    if not (isinstance(foci_threshold, int) or foci_threshold == 'auto'):
+        raise ValueError("Foci threshold must be an integer or 'auto'!")
 
     # Step=3 ensures we have 'foci_assay_folder', 'foci_folder', etc.
     folders = validate_folders(input_json_path)
@@ -359,10 +498,9 @@ def main_filter_foci(input_json_path: str, foci_threshold: int) -> None:
     for key in folder_keys:
         foci_folder = folders[key]['foci_folder']
         if os.path.isdir(foci_folder):
-            for d in os.listdir(foci_folder):
-                subfolder_full = os.path.join(foci_folder, d)
-                if os.path.isdir(subfolder_full):
-                    all_subfolders.add(d)
+            with os.scandir(foci_folder) as it:
+                all_subfolders.update(entry.name for entry in it
+                                      if entry.is_dir())
 
     if not all_subfolders:
         print("No subfolders found in any Foci folder. Exiting.")
@@ -395,14 +533,42 @@ def main_filter_foci(input_json_path: str, foci_threshold: int) -> None:
         raise ValueError("Incorrect input. Please enter yes/no.")
 
     # --- Process that subfolder in each valid folder ---
-    for key in folder_keys:
-        folder_dict = folders[key]
-        print(f"\nAnalyzing folder '{key}': {folder_dict['foci_folder']}")
-        filter_foci(folder_dict, chosen_subfolder, foci_threshold)
+    if njobs is None:
+        njobs = os.cpu_count() or 1
+    max_workers = max(1, min(njobs, len(folder_keys)))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(filter_foci,
+                            folders[key],
+                            chosen_subfolder,
+                            foci_threshold,
+                            force): key
+            for key in folder_keys
+        }
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                logging.error(f"Failed to process folder "
+                              f"'{futures[fut]}': {e}")
 
     print("\n--- All processing tasks completed ---")
 
 
+def parse_threshold(value: str):
+    """
+    Parses the foci threshold argument: an integer or 'auto'.
+    """
+    if value == 'auto':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid threshold '{value}' (expected an integer or 'auto')")
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-i',
@@ -412,9 +578,20 @@ if __name__ == '__main__':
                         required=True)
     parser.add_argument('-f',
                         '--foci_threshold',
-                        type=int,
-                        help="Threshold value for foci analysis. "
+                        type=parse_threshold,
+                        help="Threshold value for foci analysis, or 'auto' "
+                             "for a per-image Otsu threshold. "
                              "Default is 150",
                         default=150)
+    parser.add_argument('--force',
+                        action='store_true',
+                        help="Reprocess all files into a new result folder "
+                             "instead of skipping already processed ones")
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        help="Number of folders processed in parallel. "
+                             "Default is the number of CPUs",
+                        default=None)
     args = parser.parse_args()
-    main_filter_foci(args.input, args.foci_threshold)
+    main_filter_foci(args.input, args.foci_threshold, args.force, args.jobs)
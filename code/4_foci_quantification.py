@@ -2,20 +2,36 @@
 
 import argparse
 import itertools
+import json
 import logging
 import os
 import re
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 from datetime import datetime, timedelta
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from skimage import io, measure
+import tifffile
+from PIL import Image, ImageDraw, ImageFont
+from skimage import measure
 from validate_folders import validate_input_file
 
+# Patterns for timestamped result folder names, compiled once
+TIMESTAMP_RE = re.compile(r"_(\d{8}_\d{6})")
+CHANNEL_RE = re.compile(r"(Foci_\d+_Channel_\d+)")
+
+# One image_metadata.txt block, with its fields in the
+# order step 1 writes them
+METADATA_RE = re.compile(
+    r"Image Name: (?P<name>[^\n]*)\n"
+    r"\s*Pixel Width: (?P<width>\d+\.\d+)[^\n]*\n"
+    r"\s*Pixel Height: (?P<height>\d+\.\d+)[^\n]*\n"
+    r"\s*Pixel Depth: (?P<depth>\d+\.\d+)[^\n]*\n"
+    r"\s*Unit: (?P<unit>\w+)")
+
 
 def validate_folders(input_json_path: str) -> dict:
     valid_folders = validate_input_file(input_json_path)
@@ -39,23 +55,37 @@ def extract_image_key(filename: str) -> str:
     """
     Removes known prefixes/suffixes from a filename to derive a 'nuc_key'.
     """
-    filename = re.sub(r"_nuclei_projection_StarDist_processed_processed",
-                      "",
-                      filename)
-    filename = re.sub(r"^processed_", "", filename)
-    filename = re.sub(r"_foci_projection", "", filename)
-    filename = re.sub(r"\.tif$", "", filename)
-    filename = re.sub(r"\.nd2", "", filename)
+    filename = filename.replace(
+        "_nuclei_projection_StarDist_processed_processed", "")
+    filename = filename.removeprefix("processed_")
+    filename = filename.replace("_foci_projection", "")
+    filename = filename.removesuffix(".tif")
+    filename = filename.replace(".nd2", "")
     return filename
 
 
 def extract_metadata(metadata_path: str) -> dict:
     """
     Extracts pixel metadata from an image_metadata.txt file,
-    if it exists.
+    if it exists. The image_metadata.json written next to it
+    by step 1 is used instead when present.
     Returns a dict of { image_key: {"Pixel Width": float,
     "Pixel Height": float, ...}, ... }
     """
+    json_path = os.path.splitext(metadata_path)[0] + ".json"
+    if os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as file:
+            entries = json.load(file)
+        return {
+            image_key: {
+                "Pixel Width": entry["pixel_width"],
+                "Pixel Height": entry["pixel_height"],
+                "Pixel Depth": entry["pixel_depth"],
+                "Unit": entry["unit"]
+            }
+            for image_key, entry in entries.items()
+        }
+
     metadata = {}
     if not os.path.exists(metadata_path):
         return metadata
@@ -63,23 +93,14 @@ def extract_metadata(metadata_path: str) -> dict:
     with open(metadata_path, "r") as file:
         content = file.read()
 
-    blocks = content.split("Image Name: ")[1:]
-    for block in blocks:
-        image_name = block.split("\n")[0].strip()
-        image_key = os.path.splitext(image_name)[0]
-
-        px_w = re.search(r"Pixel Width: (\d+\.\d+)", block)
-        px_h = re.search(r"Pixel Height: (\d+\.\d+)", block)
-        px_d = re.search(r"Pixel Depth: (\d+\.\d+)", block)
-        unit = re.search(r"Unit: (\w+)", block)
-
-        if px_w and px_h and px_d and unit:
-            metadata[image_key] = {
-                "Pixel Width": float(px_w.group(1)),
-                "Pixel Height": float(px_h.group(1)),
-                "Pixel Depth": float(px_d.group(1)),
-                "Unit": unit.group(1)
-            }
+    for match in METADATA_RE.finditer(content):
+        image_key = os.path.splitext(match["name"].strip())[0]
+        metadata[image_key] = {
+            "Pixel Width": float(match["width"]),
+            "Pixel Height": float(match["height"]),
+            "Pixel Depth": float(match["depth"]),
+            "Unit": match["unit"]
+        }
     return metadata
 
 
@@ -88,15 +109,17 @@ def get_nuclei_mask_folder(foci_assay_folder: str) -> str:
     Finds the newest folder containing
     nuclei masks (e.g., Final_Nuclei_Mask_YYYYMMDD_HHMMSS).
     """
-    nuclei_mask_folders = [f for f in os.listdir(foci_assay_folder)
-                           if f.startswith("Final_Nuclei_Mask_")]
+    with os.scandir(foci_assay_folder) as it:
+        nuclei_mask_folders = [entry.name for entry in it
+                               if entry.is_dir()
+                               and entry.name.startswith("Final_Nuclei_Mask_")]
     if not nuclei_mask_folders:
         raise FileNotFoundError(f"No 'Final_Nuclei_Mask_' "
                                 f"folders in {foci_assay_folder}.")
 
     folder_timestamps = []
     for folder in nuclei_mask_folders:
-        match = re.search(r"_(\d{8}_\d{6})", folder)
+        match = TIMESTAMP_RE.search(folder)
         if match:
             folder_timestamps.append((folder, match.group(1)))
 
@@ -105,8 +128,8 @@ def get_nuclei_mask_folder(foci_assay_folder: str) -> str:
                          f"for 'Final_Nuclei_Mask_' "
                          f"folders in {foci_assay_folder}.")
 
-    folder_timestamps.sort(key=lambda x: x[1], reverse=True)
-    latest_folder = folder_timestamps[0][0]
+    # YYYYMMDD_HHMMSS timestamps sort chronologically as strings
+    latest_folder = max(folder_timestamps, key=lambda x: x[1])[0]
     return os.path.join(foci_assay_folder, latest_folder)
 
 
@@ -122,19 +145,19 @@ def get_latest_foci_folders(foci_assay_folder: str) -> dict:
         raise FileNotFoundError(f"Foci_Masks folder "
                                 f"does not exist in {foci_assay_folder}.")
 
-    foci_folders = [f for f in os.listdir(foci_masks_folder)
-                    if f.startswith("Foci_")]
+    with os.scandir(foci_masks_folder) as it:
+        foci_folders = [entry.name for entry in it
+                        if entry.is_dir() and entry.name.startswith("Foci_")]
     if not foci_folders:
         raise FileNotFoundError(f"No 'Foci_' folders in "
                                 f"{foci_masks_folder}.")
 
     latest_foci_folders = {}
     for folder in foci_folders:
-        match = re.search(r"_(\d{8}_\d{6})", folder)
+        match = TIMESTAMP_RE.search(folder)
         if not match:
             continue
-        channel_match = re.search(r"(Foci_\d+_Channel_\d+)",
-                                  folder)
+        channel_match = CHANNEL_RE.search(folder)
         if not channel_match:
             continue
 
@@ -160,45 +183,75 @@ def get_latest_foci_folders(foci_assay_folder: str) -> dict:
     }
 
 
+def read_image(path: str) -> np.ndarray:
+    """
+    Reads a single-page TIFF mask. The file is opened once;
+    uncompressed pages are memory-mapped instead of being copied
+    into memory, while compressed ones (such as the zlib masks of
+    steps 2 and 3) are decoded.
+    """
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        if len(tif.pages) == 1 and page.is_memmappable:
+            return np.memmap(path, mode='r',
+                             dtype=page.dtype.newbyteorder(tif.byteorder),
+                             offset=page.dataoffsets[0],
+                             shape=page.shape)
+        return tif.asarray()
+
+
 def save_labeled_image(image, output_path, title, labels=None):
     """
     Saves an image (TIFF/PNG) with labeled nuclei.
     If labels is None, it just saves the image as 16-bit TIFF.
     If labels is a dict {label: (centroid_y, centroid_x)},
-    it draws those labels in the image.
+    it draws those labels in the image, with the title
+    in a white strip above it.
     """
     if labels:
-        fig, ax = plt.subplots()
-        ax.imshow(image, cmap='gray')
+        # Gray levels scaled to the label range, as imshow did
+        lo, hi = float(image.min()), float(image.max())
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        gray = ((image - lo) * scale).astype(np.uint8)
+
+        font = ImageFont.load_default()
+        title_h = 20
+        canvas = Image.new("RGB",
+                           (gray.shape[1], gray.shape[0] + title_h),
+                           "white")
+        canvas.paste(Image.fromarray(gray).convert("RGB"), (0, title_h))
+        draw = ImageDraw.Draw(canvas)
+        draw.text((gray.shape[1] // 2, title_h // 2), title,
+                  fill="black", font=font, anchor="mm")
         for lbl, (cy, cx) in labels.items():
-            ax.text(cx, cy, str(lbl),
-                    color='red',
-                    fontsize=8,
-                    ha='center',
-                    va='center')
-        ax.set_title(title)
-        ax.axis('off')
-        plt.savefig(output_path,
-                    bbox_inches='tight',
-                    pad_inches=0,
-                    dpi=150)
-        plt.close()
+            draw.text((cx, cy + title_h), str(lbl),
+                      fill="red", font=font, anchor="mm")
+        canvas.save(output_path, "PNG")
     else:
-        io.imsave(output_path, image.astype(np.uint16))
+        tifffile.imwrite(output_path, image.astype(np.uint16))
     logging.info(f"Saved image {title} to {output_path}.")
 
 
-def labeled_nuclei_path(nuc_file_path: str,
+def labeled_nuclei_path(nuc_key: str,
                         results_folder: str) -> str:
     """
-    Generates a path for the labeled nuclei image file.
+    Generates a path for the labeled nuclei image file
+    from the image key the caller has already derived.
     """
-    nuc_filename = os.path.basename(nuc_file_path)
-    nuc_key = extract_image_key(nuc_filename)
     return os.path.join(results_folder,
                         f"{nuc_key}_labeled_nuclei.png")
 
 
+def compact_labels(labels: np.ndarray) -> np.ndarray:
+    """
+    Casts a labeled mask from measure.label (int64) to the
+    smallest unsigned dtype that holds its largest label.
+    """
+    dtype = (np.uint16 if labels.max() <= np.iinfo(np.uint16).max
+             else np.uint32)
+    return labels.astype(dtype, copy=False)
+
+
 # Intersection logic
 def build_intersection_mask(*masks):
     """
@@ -216,43 +269,30 @@ def build_intersection_mask(*masks):
         raise ValueError("All masks must have the "
                          "same shape for intersection.")
 
-    intersection_mask = np.zeros_like(masks[0],
-                                      dtype=np.uint16)
-    label_counter = 1
-
-    # gather unique labels from each mask
-    label_lists = []
-    for m in masks:
-        lbls = np.unique(m)
-        lbls = lbls[lbls != 0]
-        label_lists.append(lbls)
-
-    # use itertools.product to combine possible
-    # labels from each mask
-    for combo in itertools.product(*label_lists):
-        overlap_bool = None
-        for mask_index, lbl_val in enumerate(combo):
-            m = masks[mask_index]
-            coords = np.argwhere(m == lbl_val)
-            if coords.size == 0:
-                overlap_bool = None
-                break
-
-            if overlap_bool is None:
-                overlap_bool = np.zeros(m.shape, dtype=bool)
-                overlap_bool[coords[:, 0], coords[:, 1]] = True
-            else:
-                temp_bool = np.zeros(m.shape, dtype=bool)
-                temp_bool[coords[:, 0], coords[:, 1]] = True
-                overlap_bool &= temp_bool
-
-            if overlap_bool is not None and not np.any(overlap_bool):
-                overlap_bool = None
-                break
-
-        if overlap_bool is not None and np.any(overlap_bool):
-            intersection_mask[overlap_bool] = label_counter
-            label_counter += 1
+    # Pixels covered by every mask; nothing else to do without any
+    overlap = np.logical_and.reduce([m.ravel() != 0 for m in masks])
+    intersection_mask = np.zeros(masks[0].size, dtype=np.uint16)
+    if not overlap.any():
+        return intersection_mask.reshape(masks[0].shape)
+
+    # Label tuple of every overlapping pixel, one column per mask
+    columns = [m.ravel()[overlap] for m in masks]
+    bits = [int(col.max()).bit_length() for col in columns]
+    if sum(bits) <= 64:
+        # Pack each tuple into one uint64, first mask in the highest
+        # bits, so sorting the codes sorts the tuples
+        codes = np.zeros(len(columns[0]), dtype=np.uint64)
+        for col, n_bits in zip(columns, bits):
+            codes <<= np.uint64(n_bits)
+            codes |= col.astype(np.uint64)
+        _, inverse = np.unique(codes, return_inverse=True)
+    else:
+        _, inverse = np.unique(np.stack(columns, axis=1), axis=0,
+                               return_inverse=True)
+    # Distinct tuples come out in lexicographic order, so labels are
+    # numbered as by a product over the sorted labels of each mask
+    intersection_mask[overlap] = inverse.ravel() + 1
+    intersection_mask = intersection_mask.reshape(masks[0].shape)
 
     return intersection_mask
 
@@ -260,10 +300,14 @@ def build_intersection_mask(*masks):
 def count_foci_in_nuclei(nuclei_mask,
                          foci_mask,
                          pixel_area,
-                         image_key) -> list:
+                         image_key,
+                         nuclei_areas=None) -> list:
     """
     Counts how many labeled objects in 'foci_mask'
     fall inside each labeled nucleus in 'nuclei_mask'.
+    'nuclei_mask' must already be labeled; pass its
+    per-label pixel counts as 'nuclei_areas' to avoid
+    measuring it again for every channel.
     Returns a list of dicts with metrics:
     Foci Count, total area, relative area, etc.
     """
@@ -271,38 +315,46 @@ def count_foci_in_nuclei(nuclei_mask,
         raise ValueError("Nuclei mask and foci "
                          "mask must have the same shape.")
 
-    nuclei_props = measure.regionprops(nuclei_mask)
-    labeled_foci = measure.label(foci_mask)
+    if nuclei_areas is None:
+        nuclei_areas = np.bincount(nuclei_mask.ravel())
+    labeled_foci = compact_labels(measure.label(foci_mask))
 
-    results = []
-    for prop in nuclei_props:
-        nuc_label = prop.label
-        nuc_area_px = prop.area
-        nuc_area_micron = nuc_area_px * pixel_area
-
-        nucleus_bool = (nuclei_mask == nuc_label)
-        masked_foci = labeled_foci * nucleus_bool
-        unique_foci = np.unique(masked_foci)
-        unique_foci = unique_foci[unique_foci != 0]
-        foci_count = len(unique_foci)
-
-        total_foci_px = 0
-        for flab in unique_foci:
-            total_foci_px += np.sum(masked_foci == flab)
-        total_foci_micron = total_foci_px * pixel_area
-        rel_area = 0.0
-        if nuc_area_px > 0:
-            rel_area = (total_foci_px / nuc_area_px) * 100.0
+    # Nucleus and focus label of every foci pixel inside a nucleus
+    inside = (nuclei_mask != 0) & (labeled_foci != 0)
+    nuc_px = nuclei_mask[inside].astype(np.int64)
+    foc_px = labeled_foci[inside].astype(np.int64)
+    n_bins = len(nuclei_areas)
+
+    # Foci pixels per nucleus
+    foci_px_per_nucleus = np.bincount(nuc_px, minlength=n_bins)
+
+    # Distinct foci per nucleus, counted over the distinct
+    # (nucleus, focus) pairs rather than a full 2D histogram
+    n_foci = int(labeled_foci.max()) + 1
+    pairs = np.unique(nuc_px * n_foci + foc_px)
+    foci_per_nucleus = np.bincount(pairs // n_foci, minlength=n_bins)
 
+    # All per-nucleus metrics at once, for the labels present
+    nuc_labels = np.flatnonzero(nuclei_areas[1:]) + 1
+    nuc_area_px = nuclei_areas[nuc_labels]
+    foci_count = foci_per_nucleus[nuc_labels]
+    total_foci_px = foci_px_per_nucleus[nuc_labels]
+    rel_area = total_foci_px / nuc_area_px * 100.0
+
+    results = []
+    for row in zip(nuc_labels.tolist(), foci_count.tolist(),
+                   nuc_area_px.tolist(), total_foci_px.tolist(),
+                   rel_area.tolist()):
+        nuc_label, count, area_px, foci_px, rel = row
         results.append({
             "Image Key": image_key,  # Ensure this column is always present
             "Nucleus": nuc_label,    # Ensure this column is always present
-            "Foci Count": foci_count,
-            "Nucleus Area (pixels)": nuc_area_px,
-            "Nucleus Area (micron²)": nuc_area_micron,
-            "Total Foci Area (pixels)": total_foci_px,
-            "Total Foci Area (micron²)": total_foci_micron,
-            "Relative Foci Area (%)": round(rel_area, 2),
+            "Foci Count": count,
+            "Nucleus Area (pixels)": area_px,
+            "Nucleus Area (micron²)": area_px * pixel_area,
+            "Total Foci Area (pixels)": foci_px,
+            "Total Foci Area (micron²)": foci_px * pixel_area,
+            "Relative Foci Area (%)": round(rel, 2),
         })
 
     # Ensure the DataFrame is not empty and
@@ -349,15 +401,32 @@ def process_nuclei_image(nuc_file_path: str,
         logging.warning(f"No metadata for {nuc_key}. Skipping.")
         return []
 
+    # Start reading the foci channels in background threads,
+    # so their decoding overlaps with the nuclei labeling below
+    channel_names = sorted(foci_channels_info.keys())
+    reader = ThreadPoolExecutor(max_workers=max(1, len(channel_names)))
+    pending = {ch_name: reader.submit(read_image,
+                                      foci_channels_info[ch_name])
+               for ch_name in channel_names}
+    reader.shutdown(wait=False)
+
     # Load nucleus
-    nuclei_mask = io.imread(nuc_file_path)
-    nuclei_labels = measure.label(nuclei_mask)
-    nuclei_props = measure.regionprops(nuclei_labels)
-
-    # Save labeled nucleus image
-    labels_dict = {prop.label: prop.centroid
-                   for prop in nuclei_props}
-    labeled_path = labeled_nuclei_path(nuc_file_path,
+    nuclei_mask = read_image(nuc_file_path)
+    nuclei_labels = compact_labels(measure.label(nuclei_mask))
+    nuclei_areas = np.bincount(nuclei_labels.ravel())
+
+    # Save labeled nucleus image, with each label at its centroid
+    rows, cols = np.nonzero(nuclei_labels)
+    px_labels = nuclei_labels[rows, cols]
+    n_bins = len(nuclei_areas)
+    present = np.flatnonzero(nuclei_areas[1:]) + 1
+    centroid_y = (np.bincount(px_labels, weights=rows, minlength=n_bins)
+                  [present] / nuclei_areas[present])
+    centroid_x = (np.bincount(px_labels, weights=cols, minlength=n_bins)
+                  [present] / nuclei_areas[present])
+    labels_dict = dict(zip(present.tolist(),
+                           zip(centroid_y.tolist(), centroid_x.tolist())))
+    labeled_path = labeled_nuclei_path(nuc_key,
                                        results_folder)
     save_labeled_image(nuclei_labels,
                        labeled_path,
@@ -369,15 +438,17 @@ def process_nuclei_image(nuc_file_path: str,
     px_height = metadata[nuc_key]["Pixel Height"]
     pixel_area_micron = px_width * px_height
 
-    # Load all foci channel masks
-    channel_names = sorted(foci_channels_info.keys())
+    # Collect all foci channel masks
     channel_masks = {}
     for ch_name in channel_names:
         path_ch = foci_channels_info[ch_name]
-        if not os.path.exists(path_ch):
+        # The paths come from a directory listing, so no separate
+        # existence check is needed before reading
+        try:
+            foci_mask = pending[ch_name].result()
+        except FileNotFoundError:
             logging.warning(f"Foci file not found: {path_ch}")
             continue
-        foci_mask = io.imread(path_ch)
         if foci_mask.shape != nuclei_mask.shape:
             logging.warning(f"Foci shape {foci_mask.shape} "
                             f"!= Nuclei shape {nuclei_mask.shape}. "
@@ -396,8 +467,15 @@ def process_nuclei_image(nuc_file_path: str,
         res = count_foci_in_nuclei(nuclei_labels,
                                    f_mask,
                                    pixel_area_micron,
-                                   nuc_key)
-        df_res = pd.DataFrame(res)
+                                   nuc_key,
+                                   nuclei_areas)
+        df_res = pd.DataFrame(res).set_index(["Image Key", "Nucleus"])
+        # Nucleus areas are the same for every channel,
+        # so only the first channel keeps them
+        if all_dfs:
+            df_res.drop(columns=["Nucleus Area (pixels)",
+                                 "Nucleus Area (micron²)"],
+                        inplace=True)
         # rename columns
         df_res.rename(columns={
             "Foci Count":
@@ -411,18 +489,13 @@ def process_nuclei_image(nuc_file_path: str,
         }, inplace=True)
         all_dfs.append(df_res)
 
-    # Merge single channels
-    df_single = all_dfs[0]
-    for df_next in all_dfs[1:]:
-        # we allow duplicates of "Nucleus Area (pixels)"
-        # but they are the same => no conflict yet
-        df_single = df_single.merge(df_next,
-                                    on=["Image Key", "Nucleus"],
-                                    how="outer")
+    # Every frame has one row per nucleus of this image, so
+    # the channels are joined side by side on that index
+    df_single = pd.concat(all_dfs, axis=1)
 
     # If user doesn't want colocalization => return single
     if not perform_colocalization:
-        return df_single.to_dict("records")
+        return df_single.reset_index().to_dict("records")
 
     # Build intersection masks for subsets
     n_channels = len(channel_masks)
@@ -454,7 +527,9 @@ def process_nuclei_image(nuc_file_path: str,
                                  f"{nuc_key}_{subset_str}.tif")
             save_path = os.path.join(results_folder,
                                      intersection_name)
-            io.imsave(save_path, inverted_mask)
+            tifffile.imwrite(save_path, inverted_mask,
+                             compression='zlib',
+                             compressionargs={'level': 1})
             logging.info(f"Saved intersection mask "
                          f"(black objects/white bg): {save_path}")
 
@@ -463,12 +538,14 @@ def process_nuclei_image(nuc_file_path: str,
             inter_res = count_foci_in_nuclei(nuclei_labels,
                                              intersection_mask,
                                              pixel_area_micron,
-                                             nuc_key)
-            df_temp = pd.DataFrame(inter_res)
+                                             nuc_key,
+                                             nuclei_areas)
+            df_temp = (pd.DataFrame(inter_res)
+                       .set_index(["Image Key", "Nucleus"]))
 
             # For intersection-based results,
             # we don't want repeated nucleus-area columns
-            # because merges cause duplicates.
+            # because joins cause duplicates.
             # So let's drop them before renaming:
             # 'Nucleus Area (pixels)' and 'Nucleus Area (micron²)'
             # are redundant
@@ -495,31 +572,15 @@ def process_nuclei_image(nuc_file_path: str,
             }, inplace=True)
             df_intersections.append(df_temp)
 
-    if df_intersections:
-        df_inter_merged = df_intersections[0]
-        for df_next in df_intersections[1:]:
-            df_inter_merged = df_inter_merged.merge(df_next,
-                                                    on=["Image Key",
-                                                        "Nucleus"],
-                                                    how="outer")
-    else:
-        df_inter_merged = pd.DataFrame()
-
-    if not df_inter_merged.empty:
-        df_final = df_single.merge(df_inter_merged,
-                                   on=["Image Key", "Nucleus"],
-                                   how="outer")
-    else:
-        df_final = df_single
-
-    return df_final.to_dict("records")
+    df_final = pd.concat([df_single, *df_intersections], axis=1)
+    return df_final.reset_index().to_dict("records")
 
 
 # Gathering folders
 def gather_paths_and_channels(base_folder: str):
     """
     1) Finds the newest nuclei folder,
-    2) Collects all *.tif files (nuclei),
+    2) Collects all *.tif files (nuclei) as {nuc_key: path},
     3) Finds the newest foci folders by channel,
     4) Builds channels_dict[nuc_key][channel_name] = path_to_foci_file
     """
@@ -527,42 +588,43 @@ def gather_paths_and_channels(base_folder: str):
                                      "foci_assay")
     nuclei_mask_folder = get_nuclei_mask_folder(foci_assay_folder)
 
-    nuclei_files = []
-    for f in os.listdir(nuclei_mask_folder):
-        if f.endswith(".tif"):
-            nuclei_files.append(os.path.join(nuclei_mask_folder, f))
+    with os.scandir(nuclei_mask_folder) as it:
+        nuclei_files = {extract_image_key(entry.name): entry.path
+                        for entry in it if entry.name.endswith(".tif")}
 
     latest_foci = get_latest_foci_folders(foci_assay_folder)
     channels_dict = {}
 
     for channel_name, foci_folder_path in latest_foci.items():
-        foci_files = [fn for fn in
-                      os.listdir(foci_folder_path)
-                      if fn.endswith(".tif")]
-        for tif_file in foci_files:
-            foci_key = extract_image_key(tif_file)
-            if foci_key not in channels_dict:
-                channels_dict[foci_key] = {}
-            channels_dict[foci_key][channel_name] = os.path.join(foci_folder_path,
-                                                                 tif_file)
+        with os.scandir(foci_folder_path) as it:
+            for entry in it:
+                if not entry.name.endswith(".tif"):
+                    continue
+                foci_key = extract_image_key(entry.name)
+                if foci_key not in channels_dict:
+                    channels_dict[foci_key] = {}
+                channels_dict[foci_key][channel_name] = entry.path
 
     return nuclei_files, channels_dict
 
 
 # Parallel driver
-def parallel_processing(nuclei_files: list,
+def parallel_processing(nuclei_files: dict,
                         channels_dict: dict,
                         metadata: dict,
                         results_folder: str,
                         perform_colocalization: bool,
                         max_workers: int) -> pd.DataFrame:
     """gi
-    Runs parallel processing of the given list of nuclei_files.
+    Runs parallel processing of the given nuclei_files,
+    a dict {nuc_key: path} from gather_paths_and_channels.
     Gathers all results into a single DataFrame.
     Logs approximate time to finish after each completed task.
     """
 
-    all_results = []
+    # One compact frame per image, so the row dicts of
+    # finished images do not pile up until the end
+    frames = []
     total_tasks = len(nuclei_files)
     start_time = time.time()
 
@@ -571,21 +633,12 @@ def parallel_processing(nuclei_files: list,
 
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
         futures = []
-        for nuc_file_path in nuclei_files:
-            nuc_filename = os.path.basename(nuc_file_path)
-            nuc_key = extract_image_key(nuc_filename)
-
+        for nuc_key, nuc_file_path in nuclei_files.items():
             if nuc_key not in channels_dict:
                 logging.warning(f"No foci channels found for {nuc_key}")
                 continue
 
             foci_channels_info = channels_dict[nuc_key]
-            # ES
-            print(len(nuc_file_path))
-            print(len(foci_channels_info))
-            print(len(metadata))
-            print(len(results_folder))
-            print(len([perform_colocalization]))
             fut = executor.submit(
                 process_nuclei_image,
                 nuc_file_path,
@@ -598,7 +651,8 @@ def parallel_processing(nuclei_files: list,
 
         for i, fut in enumerate(as_completed(futures), start=1):
             partial_res = fut.result()  # list of dict
-            all_results.extend(partial_res)
+            if partial_res:
+                frames.append(pd.DataFrame(partial_res))
 
             elapsed = time.time() - start_time
             avg_time_per_task = elapsed / i
@@ -614,11 +668,12 @@ def parallel_processing(nuclei_files: list,
                 f"ETA ~ {finish_time_est.strftime('%H:%M:%S')}."
             )
 
-    df = pd.DataFrame(all_results)
-    return df
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
 
-def main_summarize_res(input_json_path: str, njobs=4) -> None:
+def main_summarize_res(input_json_path: str, njobs: int = None) -> None:
     """
     Main function:
       1) Reads JSON with folder paths,
@@ -645,6 +700,9 @@ def main_summarize_res(input_json_path: str, njobs=4) -> None:
                      .strip().lower())
     perform_colocalization = (co_loc_answer in ("yes", "y"))
 
+    if njobs is None:
+        njobs = os.cpu_count() or 1
+
     for base_folder, info in folder_dicts.items():
         foci_assay_folder = info["foci_assay_folder"]
         now_str = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -688,7 +746,10 @@ def main_summarize_res(input_json_path: str, njobs=4) -> None:
         df_results = df_results.sort_values(by=["Image Key", "Nucleus"])
         output_csv = os.path.join(results_folder,
                                   "all_results_with_coloc_universal.csv")
-        df_results.to_csv(output_csv, index=False)
+        # A large buffer lets the table reach the disk in a few writes
+        with open(output_csv, 'w', encoding='utf-8', newline='',
+                  buffering=1 << 23) as f:
+            df_results.to_csv(f, index=False)
         logging.info(f"Saved result: {output_csv}")
 
     logging.info("All processing completed.")
@@ -707,8 +768,9 @@ if __name__ == "__main__":
     parser.add_argument("-j",
                         "--jobs",
                         required=False,
-                        default=4,
+                        type=int,
+                        default=None,
                         help="Number of CPU to run the script. "
-                             "Default is 4")
+                             "Default is the number of CPUs")
     args = parser.parse_args()
     main_summarize_res(args.input, njobs=args.jobs)
@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+from skimage import measure
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "code")
+sys.path.insert(0, CODE_DIR)
+
+_spec = importlib.util.spec_from_file_location(
+    "foci_mask_generation",
+    os.path.join(CODE_DIR, "3_foci_mask_generation.py"))
+foci_mask_generation = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(foci_mask_generation)
+
+
+def test_touching_foci_stay_separate_after_8_connected_labeling():
+    yy, xx = np.mgrid[:40, :60]
+    image = np.zeros((40, 60), dtype=np.uint8)
+    # Two touching discs offset diagonally, so the line between
+    # them runs at an angle
+    image[(yy - 20) ** 2 + (xx - 20) ** 2 <= 36] = 200
+    image[(yy - 23) ** 2 + (xx - 30) ** 2 <= 36] = 200
+    assert measure.label(image > 0).max() == 1
+
+    mask = foci_mask_generation.segment_foci(image, threshold=100)
+
+    assert measure.label(mask > 0).max() == 2
+
+
+def test_to_8bit_rounds_like_imagej():
+    image = np.array([[0, 100, 1000, 4095]], dtype=np.uint16)
+    scale = 256.0 / 4096
+    # ImageJ's TypeConverter: (int)(v * scale + 0.5), capped at 255
+    expected = [min(int(v * scale + 0.5), 255) for v in image.ravel()]
+
+    assert foci_mask_generation.to_8bit(image).ravel().tolist() == expected
+
+
+def test_imagej_unit_is_ascii():
+    assert foci_mask_generation.imagej_unit("µm") == "micron"
+    assert foci_mask_generation.imagej_unit("μm") == "micron"
+    assert foci_mask_generation.imagej_unit("nm") == "nm"
+    foci_mask_generation.imagej_unit("Å").encode("ascii")
@@ -0,0 +1,168 @@
+import importlib.util
+import itertools
+import os
+import sys
+
+import numpy as np
+import pytest
+from skimage import measure
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "code")
+sys.path.insert(0, CODE_DIR)
+
+_spec = importlib.util.spec_from_file_location(
+    "foci_quantification",
+    os.path.join(CODE_DIR, "4_foci_quantification.py"))
+foci_quantification = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(foci_quantification)
+
+
+def reference_count_foci(nuclei_mask, foci_mask, pixel_area, image_key):
+    """The original per-nucleus loop of count_foci_in_nuclei."""
+    labeled_foci = measure.label(foci_mask)
+    results = []
+    for prop in measure.regionprops(nuclei_mask):
+        nucleus_bool = nuclei_mask == prop.label
+        masked_foci = labeled_foci * nucleus_bool
+        unique_foci = np.unique(masked_foci)
+        unique_foci = unique_foci[unique_foci != 0]
+        total_foci_px = 0
+        for flab in unique_foci:
+            total_foci_px += np.sum(masked_foci == flab)
+        rel_area = 0.0
+        if prop.area > 0:
+            rel_area = (total_foci_px / prop.area) * 100.0
+        results.append({
+            "Image Key": image_key,
+            "Nucleus": prop.label,
+            "Foci Count": len(unique_foci),
+            "Nucleus Area (pixels)": prop.area,
+            "Nucleus Area (micron²)": prop.area * pixel_area,
+            "Total Foci Area (pixels)": total_foci_px,
+            "Total Foci Area (micron²)": total_foci_px * pixel_area,
+            "Relative Foci Area (%)": round(rel_area, 2),
+        })
+    if not results:
+        results.append({
+            "Image Key": image_key,
+            "Nucleus": 0,
+            "Foci Count": 0,
+            "Nucleus Area (pixels)": 0,
+            "Nucleus Area (micron²)": 0,
+            "Total Foci Area (pixels)": 0,
+            "Total Foci Area (micron²)": 0,
+            "Relative Foci Area (%)": 0.0,
+        })
+    return results
+
+
+def reference_intersection(*masks):
+    """The original itertools.product build_intersection_mask."""
+    intersection_mask = np.zeros_like(masks[0], dtype=np.uint16)
+    label_counter = 1
+    label_lists = [np.unique(m)[np.unique(m) != 0] for m in masks]
+    for combo in itertools.product(*label_lists):
+        overlap = np.ones(masks[0].shape, dtype=bool)
+        for m, lbl in zip(masks, combo):
+            overlap &= m == lbl
+        if overlap.any():
+            intersection_mask[overlap] = label_counter
+            label_counter += 1
+    return intersection_mask
+
+
+def random_labels(rng, shape=(60, 60), fill=0.6):
+    return measure.label(rng.random(shape) > fill)
+
+
+def assert_rows_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for row, ref in zip(actual, expected):
+        assert row.keys() == ref.keys()
+        for key, value in ref.items():
+            if key == "Image Key":
+                assert row[key] == value
+            else:
+                assert row[key] == pytest.approx(value)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_count_foci_matches_reference_loop(seed):
+    rng = np.random.default_rng(seed)
+    nuclei = random_labels(rng).astype(np.uint16)
+    foci = (rng.random(nuclei.shape) > 0.7).astype(np.uint8) * 255
+
+    assert_rows_equal(
+        foci_quantification.count_foci_in_nuclei(nuclei, foci, 0.1, "k"),
+        reference_count_foci(nuclei, foci, 0.1, "k"))
+
+
+def test_count_foci_without_nuclei():
+    nuclei = np.zeros((20, 20), dtype=np.uint16)
+    foci = np.full((20, 20), 255, dtype=np.uint8)
+
+    assert_rows_equal(
+        foci_quantification.count_foci_in_nuclei(nuclei, foci, 0.1, "k"),
+        reference_count_foci(nuclei, foci, 0.1, "k"))
+
+
+def test_count_foci_without_foci():
+    rng = np.random.default_rng(0)
+    nuclei = random_labels(rng).astype(np.uint16)
+    foci = np.zeros(nuclei.shape, dtype=np.uint8)
+
+    assert_rows_equal(
+        foci_quantification.count_foci_in_nuclei(nuclei, foci, 0.1, "k"),
+        reference_count_foci(nuclei, foci, 0.1, "k"))
+
+
+def test_count_foci_with_label_gaps():
+    nuclei = np.zeros((30, 30), dtype=np.uint16)
+    nuclei[2:10, 2:10] = 3
+    nuclei[15:28, 15:28] = 7
+    foci = np.zeros((30, 30), dtype=np.uint8)
+    foci[4:6, 4:6] = 255
+    foci[17:19, 17:19] = 255
+    foci[22:25, 22:25] = 255
+
+    rows = foci_quantification.count_foci_in_nuclei(nuclei, foci, 0.1, "k")
+
+    assert [row["Nucleus"] for row in rows] == [3, 7]
+    assert [row["Foci Count"] for row in rows] == [1, 2]
+    assert_rows_equal(rows, reference_count_foci(nuclei, foci, 0.1, "k"))
+
+
+@pytest.mark.parametrize("n_masks", [2, 3])
+@pytest.mark.parametrize("seed", range(3))
+def test_intersection_matches_product_semantics(n_masks, seed):
+    rng = np.random.default_rng(seed)
+    masks = [random_labels(rng, fill=0.5) for _ in range(n_masks)]
+
+    result = foci_quantification.build_intersection_mask(*masks)
+
+    assert result.dtype == np.uint16
+    np.testing.assert_array_equal(result, reference_intersection(*masks))
+
+
+def test_intersection_of_non_overlapping_masks_is_empty():
+    first = np.zeros((10, 10), dtype=np.int64)
+    second = np.zeros((10, 10), dtype=np.int64)
+    first[:, :5] = 1
+    second[:, 5:] = 2
+
+    result = foci_quantification.build_intersection_mask(first, second)
+
+    assert result.dtype == np.uint16
+    assert result.shape == (10, 10)
+    assert not result.any()
+
+
+def test_intersection_of_binary_masks():
+    first = np.zeros((10, 10), dtype=np.uint8)
+    second = np.zeros((10, 10), dtype=np.uint8)
+    first[2:6, 2:6] = 255
+    second[4:8, 4:8] = 255
+
+    np.testing.assert_array_equal(
+        foci_quantification.build_intersection_mask(first, second),
+        reference_intersection(first, second))